@@ -3,6 +3,7 @@ from __future__ import annotations
 from celery import Celery
 from celery.result import AsyncResult
 
+from shared.celery_common import TASK_ROUTES, serialization_conf
 from shared.settings import get_settings
 
 settings = get_settings()
@@ -14,9 +15,8 @@ celery = Celery(
 )
 
 celery.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
+    **serialization_conf(),
+    task_routes=TASK_ROUTES,
     timezone="UTC",
     enable_utc=True,
 )
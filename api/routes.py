@@ -4,6 +4,7 @@ from typing import Any, Optional
 
 from fastapi import APIRouter, Header, HTTPException, Query
 
+from shared.cache import RedisAnswerCache
 from shared.db import get_session, init_db
 from shared.models import AuditLog, Chat, ConversationTurn, Message, User
 from shared.schemas import (
@@ -26,6 +27,9 @@ from .celery_client import get_result, send_task
 settings = get_settings()
 router = APIRouter()
 
+# тот же Redis-кэш ответов, что у воркера: синхронный ingest тоже должен сбрасывать его версию
+_exact_answer_cache = RedisAnswerCache(settings.redis_url, ttl_s=settings.answer_cache_ttl_s)
+
 
 def _admin_guard(x_admin_token: Optional[str]) -> None:
     if not x_admin_token or x_admin_token != settings.admin_token:
@@ -65,12 +69,15 @@ def admin_ingest(
 
         with get_session() as session:
             r = ingest_url(session, url=url, title=req.title, meta=req.meta)
-            return IngestResponse(
-                source_id=r.source_id,
-                document_id=r.document_id,
-                chunks_upserted=r.chunks_upserted,
-                changed=r.changed,
-            )
+
+        if r.changed:
+            _exact_answer_cache.invalidate()
+        return IngestResponse(
+            source_id=r.source_id,
+            document_id=r.document_id,
+            chunks_upserted=r.chunks_upserted,
+            changed=r.changed,
+        )
 
     task = send_task("worker.tasks.ingest_source", url, req.title, req.meta)
     return IngestTaskResponse(task_id=str(task.id))
@@ -117,6 +124,8 @@ def admin_ingest_batch(
                 except Exception as exc:
                     errors.append({"url": url, "error": str(exc)})
 
+        if any(r.changed for r in results):
+            _exact_answer_cache.invalidate()
         return IngestBatchResponse(
             total=len(urls),
             succeeded=len(results),
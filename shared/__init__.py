@@ -7,4 +7,6 @@ __all__ = [
     "retrieval",
     "ingest",
     "utils",
+    "cache",
+    "celery_common",
 ]
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Hashable, Optional
+
+import numpy as np
+
+try:
+    import orjson
+except Exception:  # pragma: no cover
+    orjson = None
+
+from .utils import normalize_text
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _json_dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+class SemanticCache:
+    """In-process LRU ответов с ключом-эмбеддингом: попадание, если косинус с сохранённым вопросом >= threshold.
+
+    Векторы лежат строками одной непрерывной float32-матрицы (maxsize, dim): поиск — один matvec
+    (BLAS, SIMD) по всем слотам, фильтры по tag/TTL — маски numpy, а не цикл по записям.
+    """
+
+    def __init__(self, maxsize: int, ttl_s: float, threshold: float) -> None:
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.threshold = threshold
+        size = max(maxsize, 0)
+        self._mat: Optional[np.ndarray] = None  # выделяется при первом put, когда известна размерность
+        self._tag_ids = np.full(size, -1, dtype=np.int64)  # -1 — пустой слот
+        self._expires = np.zeros(size, dtype=np.float64)
+        self._last_used = np.zeros(size, dtype=np.int64)
+        self._payloads: list[Any] = [None] * size
+        self._tags: dict[Hashable, int] = {}
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vec: Any) -> Optional[np.ndarray]:
+        v = np.asarray(vec, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(v))
+        if norm == 0.0:
+            return None
+        return v / norm
+
+    def get(self, qvec: Any, *, tag: Hashable = None) -> Optional[Any]:
+        q = self._unit(qvec)
+        if q is None:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            tag_id = self._tags.get(tag)
+            if tag_id is None or self._mat is None or self._mat.shape[1] != q.shape[0]:
+                return None
+
+            sims = self._mat @ q
+            live = (self._tag_ids == tag_id) & (self._expires > now)
+            sims[~live] = -np.inf
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+
+            self._clock += 1
+            self._last_used[best] = self._clock
+            return self._payloads[best]
+
+    def put(self, qvec: Any, payload: Any, *, tag: Hashable = None) -> None:
+        q = self._unit(qvec)
+        if q is None or self.maxsize <= 0:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            if self._mat is None:
+                self._mat = np.zeros((self.maxsize, q.shape[0]), dtype=np.float32)
+            elif self._mat.shape[1] != q.shape[0]:
+                return
+
+            # свободный или протухший слот, иначе — давно не использованный (LRU)
+            free = np.flatnonzero((self._tag_ids < 0) | (self._expires <= now))
+            slot = int(free[0]) if free.size else int(np.argmin(self._last_used))
+
+            self._clock += 1
+            self._mat[slot] = q
+            self._tag_ids[slot] = self._tags.setdefault(tag, len(self._tags))
+            self._expires[slot] = now + self.ttl_s
+            self._last_used[slot] = self._clock
+            self._payloads[slot] = payload
+
+
+# Single-flight: один воркер (лидер) считает ответ, одновременные копии того же вопроса ждут его результат.
+SINGLE_FLIGHT_LOCK_S = 60
+SINGLE_FLIGHT_WAIT_S = 30
+SINGLE_FLIGHT_RESULT_TTL_S = 30
+
+
+class RedisAnswerCache:
+    """Общий для всех воркеров кэш ответов по точному (нормализованному) тексту вопроса.
+
+    Ключ — blake2b(вопрос + tag). Рядом с ответом хранится версия корпуса: ingest с изменениями
+    делает INCR версии, и записи прошлых версий перестают совпадать без сканирования ключей.
+    Ошибки Redis не ломают ответ — кэш просто промахивается.
+    """
+
+    def __init__(
+        self,
+        redis_url: str | None = None,
+        ttl_s: int = 6 * 3600,
+        *,
+        client: Any = None,
+        prefix: str = "answer_cache",
+    ) -> None:
+        self.ttl_s = ttl_s
+        self.prefix = prefix
+        self._version_key = f"{prefix}:version"
+        self._redis_url = redis_url
+        self._client = client
+        self._blocking_client = client
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_s > 0
+
+    def _redis(self) -> Any:
+        if self._client is None:
+            # локальный импорт: модуль нужен и там, где Redis не используется
+            import redis
+
+            self._client = redis.Redis.from_url(self._redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        return self._client
+
+    def _blocking_redis(self) -> Any:
+        # для BLPOP: таймаут сокета должен быть больше таймаута ожидания самой команды
+        if self._blocking_client is None:
+            import redis
+
+            self._blocking_client = redis.Redis.from_url(
+                self._redis_url, socket_timeout=SINGLE_FLIGHT_WAIT_S + 5, socket_connect_timeout=0.5
+            )
+        return self._blocking_client
+
+    def _key(self, question: str, tag: Hashable) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(normalize_text(question).lower().encode("utf-8"))
+        h.update(b"\0")
+        h.update(repr(tag).encode("utf-8"))
+        return f"{self.prefix}:{h.hexdigest()}"
+
+    def get(self, question: str, *, tag: Hashable = None) -> tuple[Optional[Any], int]:
+        """(ответ или None, текущая версия корпуса) — версию передать в put для этого же ответа.
+
+        Версия -1 — неизвестна: кэш выключен (ingest её не поднимает) или Redis недоступен.
+        """
+        if not self.enabled:
+            return None, -1
+        try:
+            # версия и запись — одним MGET, один round-trip
+            raw_version, raw = self._redis().mget(self._version_key, self._key(question, tag))
+        except Exception:
+            return None, -1
+        version = int(raw_version or 0)
+        if raw is None:
+            return None, version
+        try:
+            entry = _json_loads(raw)
+        except Exception:
+            return None, version
+        if not isinstance(entry, dict) or entry.get("v") != version:
+            return None, version
+        return entry.get("r"), version
+
+    def put(self, question: str, payload: Any, *, tag: Hashable = None, version: int) -> None:
+        # версия берётся из get до построения ответа: если ingest успел её поднять, запись просто не совпадёт
+        if not self.enabled or version < 0:
+            return
+        try:
+            self._redis().set(self._key(question, tag), _json_dumps({"v": version, "r": payload}), ex=self.ttl_s)
+        except Exception:
+            return
+
+    def invalidate(self) -> None:
+        if not self.enabled:
+            return
+        try:
+            self._redis().incr(self._version_key)
+        except Exception:
+            return
+
+    def single_flight(self, question: str, *, tag: Hashable = None) -> "SingleFlight":
+        return SingleFlight(self, self._key(question, tag))
+
+
+class SingleFlight:
+    """Контекст одного вычисления ответа: claim() — стать лидером, wait() — дождаться лидера.
+
+    Лидер публикует результат через publish(); если не успел (исключение, пустой ответ),
+    на выходе из контекста публикуется null, и ожидающие сразу считают ответ сами.
+    """
+
+    def __init__(self, cache: RedisAnswerCache, key: str) -> None:
+        self._cache = cache
+        self._lock_key = f"{key}:flight"
+        self._result_key = f"{key}:flight:result"
+        self.leader = False
+
+    def __enter__(self) -> "SingleFlight":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if self.leader:
+            self.publish(None)
+
+    def claim(self) -> bool:
+        if not self._cache.enabled:
+            return True
+        try:
+            r = self._cache._redis()
+            if not r.set(self._lock_key, b"1", nx=True, ex=SINGLE_FLIGHT_LOCK_S):
+                return False
+            # результат прошлого полёта (например, null после ошибки) не должен достаться новым ожидающим
+            r.delete(self._result_key)
+        except Exception:
+            return True
+        self.leader = True
+        return True
+
+    def wait(self, timeout_s: int = SINGLE_FLIGHT_WAIT_S) -> Optional[Any]:
+        try:
+            r = self._cache._blocking_redis()
+            item = r.blpop([self._result_key], timeout=timeout_s)
+            if item is None:
+                return None
+            raw = item[1]
+            # возвращаем значение в список для остальных ожидающих этого же полёта
+            r.rpush(self._result_key, raw)
+            r.expire(self._result_key, SINGLE_FLIGHT_RESULT_TTL_S)
+            return _json_loads(raw)
+        except Exception:
+            return None
+
+    def publish(self, payload: Any) -> None:
+        if not self.leader:
+            return
+        self.leader = False
+        try:
+            r = self._cache._redis()
+            r.rpush(self._result_key, _json_dumps(payload))
+            r.expire(self._result_key, SINGLE_FLIGHT_RESULT_TTL_S)
+            r.delete(self._lock_key)
+        except Exception:
+            return
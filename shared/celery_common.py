@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from decimal import Decimal
+from typing import Any
+
+from kombu.serialization import register
+
+try:
+    import orjson
+except Exception:  # pragma: no cover
+    orjson = None
+
+ORJSON_CONTENT_TYPE = "application/x-orjson"
+
+# Своя очередь на каждый тип нагрузки, чтобы длинный ingest не стоял перед ответами и наоборот:
+# llm — ожидание OpenAI (threads), ingest — загрузка/парсинг/эмбеддинги (prefork), admin — служебное.
+# Незамаршрутизированное по-прежнему уходит в очередь по умолчанию "celery".
+LLM_QUEUE = "llm"
+INGEST_QUEUE = "ingest"
+ADMIN_QUEUE = "admin"
+TASK_ROUTES: dict[str, dict[str, str]] = {
+    "worker.tasks.answer_question": {"queue": LLM_QUEUE},
+    "worker.tasks.ingest_source": {"queue": INGEST_QUEUE},
+    "worker.tasks.ingest_batch_sources": {"queue": INGEST_QUEUE},
+    "worker.tasks.ingest_sources_bulk": {"queue": INGEST_QUEUE},
+    "worker.tasks.init_db": {"queue": ADMIN_QUEUE},
+}
+
+
+def _orjson_default(obj: Any) -> Any:
+    # то, что штатный kombu json умеет сверх orjson (UUID/datetime orjson пишет сам)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if hasattr(obj, "__json__"):
+        return obj.__json__()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def serialization_conf() -> dict[str, Any]:
+    """Настройки сериализации Celery, общие для api-клиента и воркера (должны совпадать)."""
+    if orjson is None:
+        return {"task_serializer": "json", "result_serializer": "json", "accept_content": ["json"]}
+
+    register("orjson", _orjson_dumps, orjson.loads, content_type=ORJSON_CONTENT_TYPE, content_encoding="utf-8")
+    # json остаётся в accept_content: сообщения/результаты, записанные до перехода, читаются как раньше
+    return {
+        "task_serializer": "orjson",
+        "result_serializer": "orjson",
+        "accept_content": ["orjson", "json"],
+    }
@@ -24,6 +24,11 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
+# Чтение без транзакции: в AUTOCOMMIT нет BEGIN/COMMIT на каждый вопрос. Тот же пул соединений —
+# уровень изоляции выставляется на время выдачи соединения и сбрасывается при возврате в пул.
+ro_engine = engine.execution_options(isolation_level="AUTOCOMMIT")
+ReadOnlySessionLocal = sessionmaker(bind=ro_engine, autoflush=False, expire_on_commit=False, future=True)
+
 
 @contextmanager
 def get_session() -> Session:
@@ -38,6 +43,16 @@ def get_session() -> Session:
         session.close()
 
 
+@contextmanager
+def get_ro_session() -> Session:
+    # только для чтения: ничего не коммитим, на выходе соединение просто возвращается в пул
+    session: Session = ReadOnlySessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
 def init_db() -> None:
     # 1) Extensions + schema in AUTOCOMMIT, чтобы сбой по одному extension не "отравлял" DDL-транзакцию.
     with engine.connect() as conn:
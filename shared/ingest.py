@@ -8,10 +8,11 @@ from datetime import datetime, timezone
 from typing import Any, Optional, Tuple
 from urllib.parse import urldefrag, urlparse
 
+import numpy as np
 import requests
 from bs4 import BeautifulSoup
 from pypdf import PdfReader
-from sqlalchemy import select
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
@@ -674,34 +675,34 @@ def _store_document_and_chunks(
         segments = [Segment(text=content_text, unit_type="chunk", unit_id="0")]
 
     chunk_texts = [s.text for s in segments]
-    embeddings: list[list[float] | None]
+    embeddings: list[np.ndarray | None]
     try:
-        embeddings_raw = llm.embed_texts(chunk_texts, batch_size=32)
-        embeddings = [list(v) for v in embeddings_raw]
+        # строки float32-матрицы уходят в pgvector как есть, без промежуточных list[float]
+        embeddings = list(llm.embed_texts(chunk_texts, batch_size=32))
     except Exception:
         embeddings = [None] * len(segments)
 
-    upserted = 0
-    for idx, seg in enumerate(segments):
-        vec = embeddings[idx] if idx < len(embeddings) else None
-        session.add(
-            Chunk(
-                document_id=doc.id,
-                idx=idx,
-                path=seg.path,
-                heading=seg.heading,
-                unit_type=seg.unit_type,
-                unit_id=seg.unit_id,
-                part=int(seg.part or 0),
-                text=seg.text,
-                token_count=estimate_tokens(seg.text),
-                embedding=vec,
-            )
-        )
-        upserted += 1
-
-    session.flush()
-    return IngestResult(source_id=src.id, document_id=doc.id, chunks_upserted=upserted, changed=True)
+    # ORM bulk INSERT: одна executemany-пачка (insertmanyvalues) на все чанки документа,
+    # без Chunk-объектов в identity map — они после вставки здесь не нужны
+    rows = [
+        {
+            "document_id": doc.id,
+            "idx": idx,
+            "path": seg.path,
+            "heading": seg.heading,
+            "unit_type": seg.unit_type,
+            "unit_id": seg.unit_id,
+            "part": int(seg.part or 0),
+            "text": seg.text,
+            "token_count": estimate_tokens(seg.text),
+            "embedding": embeddings[idx] if idx < len(embeddings) else None,
+        }
+        for idx, seg in enumerate(segments)
+    ]
+    if rows:
+        session.execute(insert(Chunk), rows)
+
+    return IngestResult(source_id=src.id, document_id=doc.id, chunks_upserted=len(rows), changed=True)
 
 
 def ingest_url(session: Session, url: str, title: Optional[str] = None, meta: Optional[dict[str, Any]] = None) -> IngestResult:
@@ -4,17 +4,100 @@ import json
 import re
 from typing import Any, Dict, List, Optional
 
-from openai import OpenAI
-from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+import httpx
+import numpy as np
+from openai import APIConnectionError, APITimeoutError, BadRequestError, InternalServerError, OpenAI, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, stop_after_delay, wait_exponential
+
+try:
+    import orjson
+except Exception:  # pragma: no cover
+    orjson = None
 
 from .settings import get_settings
 
 settings = get_settings()
 
-_client: Optional[OpenAI] = None
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# ретраим только транзиентные ошибки API; баги (KeyError, ValidationError и т.п.) падают сразу
+_RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
+
+_MAX_RETRIES = settings.openai_max_retries
+_CLIENT_TIMEOUT = settings.openai_timeout_s
+_ANSWER_TIMEOUT = settings.answer_timeout_s
+
+_retry_openai = retry(
+    reraise=True,
+    stop=stop_after_attempt(_MAX_RETRIES),
+    wait=wait_exponential(multiplier=0.5, min=0.25, max=8),
+    retry=retry_if_exception_type(_RETRYABLE_ERRORS),
+)
+
+# ответ ждут синхронно (API — 70 с): новая попытка не начинается, если бюджет _ANSWER_TIMEOUT исчерпан,
+# поэтому худший случай — около двух таймаутов запроса, а не _MAX_RETRIES
+_retry_answer = retry(
+    reraise=True,
+    stop=stop_after_attempt(_MAX_RETRIES) | stop_after_delay(_ANSWER_TIMEOUT),
+    wait=wait_exponential(multiplier=0.5, min=0.25, max=8),
+    retry=retry_if_exception_type(_RETRYABLE_ERRORS),
+)
+
 _CIT_RE = re.compile(r"\[(\d{1,2})\]")
 _NEED_MORE_RE = re.compile(r"(?im)^\s*need_more_info\s*=\s*(true|false)\s*$")
 _SOURCES_BLOCK_RE = re.compile(r"(?is)(\n|^)(#+\s*)?(джерела|источники|sources)\s*:?.*$")
+_MULTI_NL_RE = re.compile(r"\n{3,}")
+
+
+_SYSTEM_PROMPT = (
+    "Ти юридичний консультант з права України. "
+    "Відповідай СУВОРО українською мовою незалежно від мови запиту. "
+    "Не вигадуй фактів або норм, використовуй лише наданий контекст і цитати [n]. "
+    "Заборонено вставляти в answer_markdown службові маркери на кшталт need_more_info=true/false. "
+    "Заборонено додавати розділ 'Джерела/Источники/Sources' у answer_markdown. "
+    "Якщо даних недостатньо, встанови need_more_info=true та додай питання для уточнення в полі questions "
+    "(без службових рядків у markdown). "
+    "Структура answer_markdown: Висновок, Норма, Що це означає на практиці, Ризики/обмеження, Що робити далі; "
+    "за потреби — Питання для уточнення."
+)
+
+_USER_TEMPLATE = (
+    "Питання:\n{question}\n\n"
+    "Режим: {mode}. Стиль: {style}\n\n"
+    "Історія діалогу:\n{history}\n\n"
+    "Контекст (фрагменти):\n{context}\n\n"
+    "Підказка для цитування:\n{hint}\n"
+)
+
+_MODE_STYLES = {
+    "consult": "Консультаційний, з планом дій і ризиками.",
+    "brief": "Короткий по суті, але з цитатами.",
+}
+
+_SYSTEM_MESSAGE = {"role": "system", "content": _SYSTEM_PROMPT}
+
+_ANSWER_FORMAT: dict[str, Any] = {
+    "format": {
+        "type": "json_schema",
+        "name": "consultation_answer",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "answer_markdown": {"type": "string"},
+                "citations_used": {
+                    "type": "array",
+                    "items": {"type": "integer", "minimum": 1, "maximum": 99},
+                },
+                "need_more_info": {"type": "boolean"},
+                "questions": {"type": "array", "items": {"type": "string"}},
+                "notes": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["answer_markdown", "citations_used", "need_more_info", "questions"],
+            "additionalProperties": False,
+        },
+        "strict": True,
+    }
+}
 
 
 def _is_openai_enabled() -> bool:
@@ -22,43 +105,27 @@ def _is_openai_enabled() -> bool:
     return bool(key and key.lower() not in {"changeme", "change-me", "your-openai-key"})
 
 
+# settings неизменны на время жизни процесса — проверка ключа и клиент считаются один раз при импорте
+_OPENAI_ENABLED = _is_openai_enabled()
+_client: Optional[OpenAI] = None
+if _OPENAI_ENABLED:
+    # общий keep-alive пул поверх HTTP/2: параллельные вызовы мультиплексируются в одном TLS-соединении
+    _HTTP = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        timeout=_CLIENT_TIMEOUT,
+    )
+    # max_retries=0: повторы ведёт только tenacity (_retry_openai/_retry_answer); встроенные ретраи SDK
+    # (по умолчанию 2) множили бы попытки и растягивали вызов ответа далеко за ANSWER_TIMEOUT_S
+    _client = OpenAI(api_key=settings.openai_api_key, timeout=_CLIENT_TIMEOUT, max_retries=0, http_client=_HTTP)
+
+
 def get_client() -> OpenAI:
-    global _client
-    if not _is_openai_enabled():
-        raise RuntimeError("OPENAI_API_KEY is missing or placeholder. Set a valid key in .env.")
     if _client is None:
-        _client = OpenAI(api_key=settings.openai_api_key, timeout=settings.openai_timeout_s)
+        raise RuntimeError("OPENAI_API_KEY is missing or placeholder. Set a valid key in .env.")
     return _client
 
 
-@retry(
-    reraise=True,
-    stop=stop_after_attempt(settings.openai_max_retries),
-    wait=wait_exponential(multiplier=1, min=1, max=12),
-    retry=retry_if_exception_type(Exception),
-)
-def embed_texts(texts: List[str], *, batch_size: int = 32) -> List[List[float]]:
-    client = get_client()
-    out: List[List[float]] = []
-    i = 0
-    while i < len(texts):
-        batch = texts[i : i + batch_size]
-        resp = client.embeddings.create(model=settings.openai_embed_model, input=batch)
-        out.extend([d.embedding for d in resp.data])
-        i += batch_size
-    return out
-
-
-@retry(
-    reraise=True,
-    stop=stop_after_attempt(settings.openai_max_retries),
-    wait=wait_exponential(multiplier=1, min=1, max=12),
-    retry=retry_if_exception_type(Exception),
-)
-def embed_text(text: str) -> List[float]:
-    return embed_texts([text], batch_size=1)[0]
-
-
 def _usage_to_dict(usage: Any) -> dict[str, Any]:
     if usage is None:
         return {}
@@ -92,18 +159,14 @@ def _extract_text_from_response(resp: Any) -> str:
 
 
 def _extract_citation_numbers(text: str) -> list[int]:
-    out: list[int] = []
-    for m in _CIT_RE.findall(text or ""):
-        n = int(m)
-        if n not in out:
-            out.append(n)
-    return out
+    # dict.fromkeys — дедупликация за O(n) с сохранением порядка
+    return list(dict.fromkeys(int(m) for m in _CIT_RE.findall(text or "")))
 
 
 def _sanitize_answer_markdown(answer_md: str) -> str:
     answer_md = _NEED_MORE_RE.sub("", answer_md or "")
     answer_md = _SOURCES_BLOCK_RE.sub("", answer_md)
-    answer_md = re.sub(r"\n{3,}", "\n\n", answer_md).strip()
+    answer_md = _MULTI_NL_RE.sub("\n\n", answer_md).strip()
     return answer_md
 
 
@@ -111,7 +174,7 @@ def _coerce_structured_payload(payload: Any, fallback_text: str) -> dict[str, An
     obj: dict[str, Any]
     if isinstance(payload, str):
         try:
-            parsed = json.loads(payload)
+            parsed = _json_loads(payload)
         except Exception:
             parsed = {}
         obj = parsed if isinstance(parsed, dict) else {}
@@ -154,12 +217,27 @@ def _coerce_structured_payload(payload: Any, fallback_text: str) -> dict[str, An
     }
 
 
-@retry(
-    reraise=True,
-    stop=stop_after_attempt(settings.openai_max_retries),
-    wait=wait_exponential(multiplier=1, min=1, max=12),
-    retry=retry_if_exception_type(Exception),
-)
+@_retry_openai
+def embed_texts(texts: List[str], *, batch_size: int = 32) -> np.ndarray:
+    client = get_client()
+    # один непрерывный float32-массив (n, dim) вместо списков python-float
+    out = np.empty((len(texts), settings.embed_dim), dtype=np.float32)
+    i = 0
+    while i < len(texts):
+        batch = texts[i : i + batch_size]
+        resp = client.embeddings.create(model=settings.openai_embed_model, input=batch)
+        for j, d in enumerate(resp.data):
+            out[i + j] = d.embedding
+        i += batch_size
+    return out
+
+
+# без своего @retry: embed_texts уже ретраится, вложенные декораторы давали attempts^2 попыток
+def embed_text(text: str) -> np.ndarray:
+    return embed_texts([text], batch_size=1)[0]
+
+
+@_retry_answer
 def answer_with_citations(
     *,
     question: str,
@@ -175,67 +253,37 @@ def answer_with_citations(
         f"- {h.get('role', 'user')}: {(h.get('content', '') or '').strip()}" for h in (chat_history or [])
     ).strip()
 
-    system = (
-        "Ти юридичний консультант з права України. "
-        "Відповідай СУВОРО українською мовою незалежно від мови запиту. "
-        "Не вигадуй фактів або норм, використовуй лише наданий контекст і цитати [n]. "
-        "Заборонено вставляти в answer_markdown службові маркери на кшталт need_more_info=true/false. "
-        "Заборонено додавати розділ 'Джерела/Источники/Sources' у answer_markdown. "
-        "Якщо даних недостатньо, встанови need_more_info=true та додай питання для уточнення в полі questions "
-        "(без службових рядків у markdown). "
-        "Структура answer_markdown: Висновок, Норма, Що це означає на практиці, Ризики/обмеження, Що робити далі; "
-        "за потреби — Питання для уточнення."
-    )
-
-    style = "Консультаційний, з планом дій і ризиками." if mode == "consult" else "Короткий по суті, але з цитатами."
-
-    user = (
-        f"Питання:\n{question}\n\n"
-        f"Режим: {mode}. Стиль: {style}\n\n"
-        f"Історія діалогу:\n{history_text or '(порожньо)'}\n\n"
-        f"Контекст (фрагменти):\n{chr(10).join(context_blocks)}\n\n"
-        f"Підказка для цитування:\n{citations_hint}\n"
+    style = _MODE_STYLES["consult" if mode == "consult" else "brief"]
+
+    user = _USER_TEMPLATE.format_map(
+        {
+            "question": question,
+            "mode": mode,
+            "style": style,
+            "history": history_text or "(порожньо)",
+            "context": "\n".join(context_blocks),
+            "hint": citations_hint,
+        }
     )
+    # системное сообщение статично и собирается один раз при импорте; на вызов — только user
+    messages = [_SYSTEM_MESSAGE, {"role": "user", "content": user}]
 
     try:
         resp = client.responses.create(
             model=settings.openai_model,
-            input=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": user},
-            ],
+            input=messages,
             temperature=temperature,
-            text={
-                "format": {
-                    "type": "json_schema",
-                    "name": "consultation_answer",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "answer_markdown": {"type": "string"},
-                            "citations_used": {
-                                "type": "array",
-                                "items": {"type": "integer", "minimum": 1, "maximum": 99},
-                            },
-                            "need_more_info": {"type": "boolean"},
-                            "questions": {"type": "array", "items": {"type": "string"}},
-                            "notes": {"type": "array", "items": {"type": "string"}},
-                        },
-                        "required": ["answer_markdown", "citations_used", "need_more_info", "questions"],
-                        "additionalProperties": False,
-                    },
-                    "strict": True,
-                }
-            },
+            text=_ANSWER_FORMAT,
+            timeout=_ANSWER_TIMEOUT,
         )
-    except Exception:
+    except BadRequestError:
+        # модель не принимает json_schema — повторяем без structured output; таймауты и прочие
+        # ошибки сюда не попадают, иначе зависший вызов запускал бы второй полный вызов
         resp = client.responses.create(
             model=settings.openai_model,
-            input=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": user},
-            ],
+            input=messages,
             temperature=temperature,
+            timeout=_ANSWER_TIMEOUT,
         )
 
     raw_text = _extract_text_from_response(resp)
@@ -22,9 +22,13 @@ from sqlalchemy import (
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import HALFVEC
+
+from .settings import get_settings
 
 EMBED_DIM = int(os.getenv("EMBED_DIM", "1536"))
+HNSW_M = 24
+HNSW_EF_CONSTRUCTION = 128
 
 
 def utcnow() -> datetime:
@@ -176,7 +180,8 @@ class Chunk(Base):
     text: Mapped[str] = mapped_column(Text, nullable=False)
     token_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
 
-    embedding: Mapped[Optional[list[float]]] = mapped_column(Vector(EMBED_DIM), nullable=True)
+    # halfvec (float16): вдвое меньше байт на строку и в HNSW-графе, потеря recall на cosine пренебрежима
+    embedding: Mapped[Optional[list[float]]] = mapped_column(HALFVEC(EMBED_DIM), nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, nullable=False)
 
@@ -197,24 +202,89 @@ def ensure_extra_indexes(conn) -> None:
         except Exception:
             pass
 
-    # FTS gin index (сырым SQL, без REGCONFIG-compile в SQLAlchemy)
+    # unaccent() не IMMUTABLE, поэтому в generated column/индексе нужна обёртка со словарём
     try:
         conn.execute(
             sa_text(
-                "CREATE INDEX IF NOT EXISTS ix_chunks_fts "
-                "ON chunks USING gin (to_tsvector('simple'::regconfig, unaccent(text)));"
+                "CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text "
+                "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT "
+                "AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;"
             )
         )
     except Exception:
         pass
 
-    # Vector HNSW index (может не поддерживаться на старом pgvector — поэтому try)
+    # Предвычисленный tsvector: ранжирование читает готовые лексемы, а не строит их на каждую строку.
+    # STORED-колонка заполняется для существующих строк при ADD COLUMN, отдельный backfill не нужен.
     try:
+        conn.execute(
+            sa_text(
+                "ALTER TABLE chunks ADD COLUMN IF NOT EXISTS text_tsv tsvector "
+                "GENERATED ALWAYS AS (to_tsvector('simple'::regconfig, f_unaccent(text))) STORED;"
+            )
+        )
+    except Exception:
+        pass
+
+    # FTS gin index (сырым SQL, без REGCONFIG-compile в SQLAlchemy) — теперь по text_tsv
+    try:
+        conn.execute(sa_text("DROP INDEX IF EXISTS ix_chunks_fts;"))
+        conn.execute(sa_text("CREATE INDEX IF NOT EXISTS ix_chunks_text_tsv ON chunks USING gin (text_tsv);"))
+    except Exception:
+        pass
+
+    # Старые тома: embedding как vector(N) -> halfvec(N) (pgvector >= 0.7). Индекс на vector_cosine_ops
+    # несовместим с новым типом, поэтому сносим его до ALTER и строим заново ниже.
+    try:
+        coltype = conn.execute(
+            sa_text(
+                "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+                "WHERE attrelid = 'chunks'::regclass AND attname = 'embedding';"
+            )
+        ).scalar_one_or_none()
+        if coltype is not None and coltype.startswith("vector"):
+            conn.execute(sa_text("DROP INDEX IF EXISTS ix_chunks_embedding_hnsw;"))
+            conn.execute(
+                sa_text(
+                    f"ALTER TABLE chunks ALTER COLUMN embedding TYPE halfvec({EMBED_DIM}) "
+                    f"USING embedding::halfvec({EMBED_DIM});"
+                )
+            )
+    except Exception:
+        pass
+
+    # Vector HNSW index (может не поддерживаться на старом pgvector — поэтому try).
+    # m/ef_construction задаются только при построении: индекс со старыми параметрами пересоздаём.
+    try:
+        indexdef = conn.execute(
+            sa_text("SELECT indexdef FROM pg_indexes WHERE indexname = 'ix_chunks_embedding_hnsw';")
+        ).scalar_one_or_none()
+        if indexdef is not None and (f"m='{HNSW_M}'" not in indexdef or "halfvec_cosine_ops" not in indexdef):
+            conn.execute(sa_text("DROP INDEX IF EXISTS ix_chunks_embedding_hnsw;"))
         conn.execute(
             sa_text(
                 "CREATE INDEX IF NOT EXISTS ix_chunks_embedding_hnsw "
-                "ON chunks USING hnsw (embedding vector_cosine_ops);"
+                "ON chunks USING hnsw (embedding halfvec_cosine_ops) "
+                f"WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION});"
             )
         )
     except Exception:
         pass
+
+    # Бинарный индекс (HNSW по binary_quantize(embedding), 1 бит на измерение — в 16 раз меньше halfvec)
+    # нужен только при VECTOR_QUANT=binary; без него не платим за его обновление на вставках. Значение
+    # берётся из Settings, как в retrieve() (там же читается и .env), а выражение должно совпадать
+    # с тем, что строит retrieve(), иначе планировщик индекс не возьмёт.
+    try:
+        if get_settings().vector_quant == "binary":
+            conn.execute(
+                sa_text(
+                    "CREATE INDEX IF NOT EXISTS ix_chunks_embedding_bq_hnsw "
+                    f"ON chunks USING hnsw ((binary_quantize(embedding)::bit({EMBED_DIM})) bit_hamming_ops) "
+                    f"WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION});"
+                )
+            )
+        else:
+            conn.execute(sa_text("DROP INDEX IF EXISTS ix_chunks_embedding_bq_hnsw;"))
+    except Exception:
+        pass
@@ -4,13 +4,22 @@ from dataclasses import dataclass
 from typing import List, Optional
 from uuid import UUID
 
-from sqlalchemy import func, select, text, literal_column
+import numpy as np
+from pgvector.sqlalchemy import BIT, HALFVEC
+from sqlalchemy import cast, func, literal, literal_column, select
 from sqlalchemy.orm import Session
 
 from . import llm
-from .models import Chunk, Document
+from .models import EMBED_DIM, Chunk, Document
+from .settings import get_settings
 from .utils import compact_quote, normalize_text
 
+settings = get_settings()
+
+_RRF_K = 60
+# сколько кандидатов бинарного этапа пересортировывается по точному cosine
+_BINARY_RERANK = 64
+
 
 @dataclass
 class RetrievedChunk:
@@ -28,65 +37,107 @@ class RetrievedChunk:
     score: float
 
 
-def _fts_rank_expr(query: str):
+def _fts_query_expr(query: str):
     q = normalize_text(query)
-    return func.ts_rank_cd(
-        func.to_tsvector(literal_column("'simple'"), func.unaccent(Chunk.text)),
-        func.plainto_tsquery(literal_column("'simple'"), func.unaccent(q)),
-    )
+    return func.plainto_tsquery(literal_column("'simple'"), func.unaccent(q))
+
+
+def _fts_rank_expr(tsquery):
+    # text_tsv — generated STORED колонка (см. ensure_extra_indexes)
+    return func.ts_rank_cd(literal_column("chunks.text_tsv"), tsquery)
 
 
-def retrieve(session: Session, query: str, k: int = 6) -> List[RetrievedChunk]:
+def embed_query(query: str) -> Optional[np.ndarray]:
     query = normalize_text(query)
     if not query:
-        return []
-
-    qvec = None
+        return None
     try:
-        qvec = llm.embed_text(query)
+        return llm.embed_text(query)
     except Exception:
-        qvec = None
+        return None
+
+
+def retrieve(
+    session: Session,
+    query: str,
+    k: int = 6,
+    *,
+    qvec: Optional[np.ndarray] = None,
+    embed: bool = True,
+) -> List[RetrievedChunk]:
+    """embed=False — qvec уже посчитан вызывающим (None = эмбеддинг недоступен, только FTS)."""
+    query = normalize_text(query)
+    if not query:
+        return []
 
-    candidates: dict[UUID, RetrievedChunk] = {}
+    if qvec is None and embed:
+        qvec = embed_query(query)
+
+    limit = max(20, k * 4)
+
+    # Reciprocal Rank Fusion целиком в SQL: каждая ветка отдаёт (id, ранг), сервер сливает их
+    # и возвращает только k лучших строк — без переноса кандидатов и сортировки в Python.
+    tsquery = _fts_query_expr(query)
+    rank_expr = _fts_rank_expr(tsquery)
+    fts = (
+        select(Chunk.id.label("id"), func.row_number().over(order_by=rank_expr.desc()).label("r"))
+        .where(literal_column("chunks.text_tsv").op("@@")(tsquery))
+        .order_by(rank_expr.desc())
+        .limit(limit)
+        .cte("fts")
+    )
 
     if qvec is not None:
-        stmt_vec = (
-            select(
-                Chunk.id,
-                Chunk.document_id,
-                Chunk.text,
-                Chunk.path,
-                Chunk.heading,
-                Chunk.unit_type,
-                Chunk.unit_id,
-                Chunk.embedding.cosine_distance(qvec).label("dist"),
-                Document.title,
-                Document.url,
+        binary = settings.vector_quant == "binary"
+        n_candidates = max(_BINARY_RERANK, limit) if binary else limit
+        # ef_search — ширина поиска по HNSW-графу (recall/latency); индекс отдаёт не больше ef_search строк,
+        # поэтому она не меньше числа кандидатов. На уровне сессии, а не SET LOCAL: retrieve идёт через
+        # AUTOCOMMIT-сессию, где локальная настройка умерла бы вместе с этим запросом
+        ef_search = max(settings.hnsw_ef_search, n_candidates)
+        session.execute(select(func.set_config("hnsw.ef_search", str(ef_search), False)))
+        if binary:
+            # 1-й этап: hamming по ix_chunks_embedding_bq_hnsw (то же выражение, что в индексе),
+            # 2-й: точный cosine по halfvec только для _BINARY_RERANK кандидатов.
+            # Явный CAST у параметра: binary_quantize перегружен для vector и halfvec, и с нетипизированным
+            # bind Postgres не выбирает перегрузку ("function binary_quantize(unknown) is not unique")
+            bits = BIT(EMBED_DIM)
+            qhalf = cast(literal(qvec, HALFVEC(EMBED_DIM)), HALFVEC(EMBED_DIM))
+            hamming = cast(func.binary_quantize(Chunk.embedding), bits).op("<~>")(
+                cast(func.binary_quantize(qhalf), bits)
+            )
+            candidates = (
+                select(Chunk.id.label("id"), Chunk.embedding.label("embedding"))
+                .where(Chunk.embedding.is_not(None))
+                .order_by(hamming)
+                .limit(n_candidates)
+                .subquery("bq")
+            )
+            dist = candidates.c.embedding.cosine_distance(qvec)
+            vec = (
+                select(candidates.c.id.label("id"), func.row_number().over(order_by=dist.asc()).label("r"))
+                .order_by(dist.asc())
+                .limit(limit)
+                .cte("vec")
             )
-            .join(Document, Document.id == Chunk.document_id)
-            .where(Chunk.embedding.is_not(None))
-            .order_by(text("dist ASC"))
-            .limit(max(20, k * 4))
+        else:
+            dist = Chunk.embedding.cosine_distance(qvec)
+            vec = (
+                select(Chunk.id.label("id"), func.row_number().over(order_by=dist.asc()).label("r"))
+                .where(Chunk.embedding.is_not(None))
+                .order_by(dist.asc())
+                .limit(limit)
+                .cte("vec")
+            )
+        rrf = func.coalesce(1.0 / (_RRF_K + vec.c.r), 0.0) + func.coalesce(1.0 / (_RRF_K + fts.c.r), 0.0)
+        fused = (
+            select(func.coalesce(vec.c.id, fts.c.id).label("id"), rrf.label("score"))
+            .select_from(vec.join(fts, vec.c.id == fts.c.id, full=True))
+            .subquery("fused")
         )
-        for cid, did, ctext, cpath, chead, utype, uid, dist, dtitle, durl in session.execute(stmt_vec):
-            score = float(1.0 - dist)
-            existing = candidates.get(cid)
-            if existing is None or score > existing.score:
-                candidates[cid] = RetrievedChunk(
-                    chunk_id=cid,
-                    document_id=did,
-                    title=dtitle,
-                    url=durl,
-                    path=cpath,
-                    heading=chead,
-                    unit_type=utype,
-                    unit_id=uid,
-                    text=ctext,
-                    score=score,
-                )
-
-    rank_expr = _fts_rank_expr(query).label("rank")
-    stmt_fts = (
+    else:
+        fused = select(fts.c.id, (1.0 / (_RRF_K + fts.c.r)).label("score")).subquery("fused")
+
+    stmt = (
         select(
             Chunk.id,
             Chunk.document_id,
@@ -95,48 +146,28 @@ def retrieve(session: Session, query: str, k: int = 6) -> List[RetrievedChunk]:
             Chunk.heading,
             Chunk.unit_type,
             Chunk.unit_id,
-            rank_expr,
             Document.title,
             Document.url,
+            fused.c.score,
         )
+        .join(fused, fused.c.id == Chunk.id)
         .join(Document, Document.id == Chunk.document_id)
-        .where(rank_expr > 0.0)
-        .order_by(text("rank DESC"))
-        .limit(max(20, k * 4))
+        .order_by(fused.c.score.desc())
+        .limit(k)
     )
-    for cid, did, ctext, cpath, chead, utype, uid, rank, dtitle, durl in session.execute(stmt_fts):
-        score = float(rank)
-        existing = candidates.get(cid)
-        if existing is None or score > existing.score:
-            candidates[cid] = RetrievedChunk(
-                chunk_id=cid,
-                document_id=did,
-                title=dtitle,
-                url=durl,
-                path=cpath,
-                heading=chead,
-                unit_type=utype,
-                unit_id=uid,
-                text=ctext,
-                score=score,
-            )
 
-    ranked = sorted(candidates.values(), key=lambda x: x.score, reverse=True)[:k]
-
-    out: List[RetrievedChunk] = []
-    for r in ranked:
-        out.append(
-            RetrievedChunk(
-                chunk_id=r.chunk_id,
-                document_id=r.document_id,
-                title=r.title,
-                url=r.url,
-                path=r.path,
-                heading=r.heading,
-                unit_type=r.unit_type,
-                unit_id=r.unit_id,
-                text=compact_quote(r.text, 900),
-                score=r.score,
-            )
+    return [
+        RetrievedChunk(
+            chunk_id=cid,
+            document_id=did,
+            title=dtitle,
+            url=durl,
+            path=cpath,
+            heading=chead,
+            unit_type=utype,
+            unit_id=uid,
+            text=compact_quote(ctext, 900),
+            score=float(score),
         )
-    return out
+        for cid, did, ctext, cpath, chead, utype, uid, dtitle, durl, score in session.execute(stmt)
+    ]
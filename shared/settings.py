@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from functools import lru_cache
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from pydantic import Field
+from pydantic import Field, field_validator
 
 
 class Settings(BaseSettings):
@@ -33,8 +33,22 @@ class Settings(BaseSettings):
     chunk_size_chars: int = Field(default=1200, alias="CHUNK_SIZE_CHARS")
     chunk_overlap_chars: int = Field(default=200, alias="CHUNK_OVERLAP_CHARS")
     retrieval_k: int = Field(default=6, alias="RETRIEVAL_K")
+    hnsw_ef_search: int = Field(default=40, alias="HNSW_EF_SEARCH")
+    # none | binary: первый этап по бинарному HNSW (hamming), затем пересортировка по cosine
+    vector_quant: str = Field(default="none", alias="VECTOR_QUANT")
     max_context_chars: int = Field(default=14000, alias="MAX_CONTEXT_CHARS")
 
+    # Semantic answer cache (per worker process; keyed on the corpus version kept by the exact cache)
+    semantic_cache_size: int = Field(default=256, alias="SEMANTIC_CACHE_SIZE")
+    semantic_cache_ttl_s: int = Field(default=6 * 3600, alias="SEMANTIC_CACHE_TTL_S")
+    semantic_cache_threshold: float = Field(default=0.95, alias="SEMANTIC_CACHE_THRESHOLD")
+
+    # Exact answer cache in Redis (shared by workers); 0 disables it and the semantic cache
+    answer_cache_ttl_s: int = Field(default=6 * 3600, alias="ANSWER_CACHE_TTL_S")
+
+    # Per-request timeout and retry budget for the answer LLM call (API waits 70s for the result)
+    answer_timeout_s: int = Field(default=30, alias="ANSWER_TIMEOUT_S")
+
     # Admin
     admin_token: str = Field(default="change-me", alias="ADMIN_TOKEN")
 
@@ -43,7 +57,14 @@ class Settings(BaseSettings):
     api_base_url: str = Field(default="http://api:8000", alias="API_BASE_URL")
     api_timeout_s: int = Field(default=45, alias="API_TIMEOUT_S")
 
+    @field_validator("vector_quant")
+    @classmethod
+    def _normalize_vector_quant(cls, v: str) -> str:
+        # одно значение и для индекса (shared.models.ensure_extra_indexes), и для запроса (retrieve)
+        return str(v).strip().lower()
+
 
+# один разбор env/.env на процесс; prefork-дети Celery наследуют уже готовый объект
 @lru_cache(maxsize=1)
 def get_settings() -> Settings:
     return Settings()
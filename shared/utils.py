@@ -2,23 +2,61 @@ from __future__ import annotations
 
 import hashlib
 import re
+import threading
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import List
 
-_ws_re = re.compile(r"[ \t\u00A0]+")
-_nl_re = re.compile(r"\n{3,}")
+# только прогоны, которые реально меняются (>= 2 символов или с \t/NBSP): одиночные пробелы между словами
+# не матчатся и не копируются заново
+_ws_re = re.compile("(?: [ \t\u00a0]|[\t\u00a0])[ \t\u00a0]*")
+_nl_re = re.compile("\n{3,}")
 
+# hashlib.sha256 — это OpenSSL EVP, который сам выбирает SHA-NI/AVX2-реализацию по CPUID;
+# конструктор связываем один раз, чтобы не искать атрибут модуля на каждый чанк.
+_SHA256 = hashlib.sha256
 
-def normalize_text(s: str) -> str:
-    s = s.replace("\r\n", "\n").replace("\r", "\n")
+
+# сколько входных символов на один выходной берём в окно, когда нужен только префикс результата
+_NORMALIZE_WINDOW_FACTOR = 4
+
+
+def _normalize_full(s: str) -> str:
+    if "\r" in s:
+        s = s.replace("\r\n", "\n").replace("\r", "\n")
     s = _ws_re.sub(" ", s)
     s = _nl_re.sub("\n\n", s)
     return s.strip()
 
 
-def sha256_hex(s: str) -> str:
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+def normalize_text(s: str, max_len: int | None = None) -> str:
+    # с max_len результат равен normalize_text(s)[:max_len]. Нормализованный префикс входа —
+    # префикс нормализованного целого (разойтись может лишь пробельный хвост окна, его срезает strip),
+    # поэтому достаточно обработать окно, если из него вышло больше max_len символов.
+    if max_len is not None:
+        window = max(max_len, 1) * _NORMALIZE_WINDOW_FACTOR
+        if len(s) > window:
+            head = _normalize_full(s[:window])
+            if len(head) > max_len:
+                return head[:max_len]
+        return _normalize_full(s)[:max_len]
+    return _normalize_full(s)
+
+
+def sha256_hex_bytes(b: bytes) -> str:
+    return _SHA256(b).hexdigest()
+
+
+def sha256_many(items: List[bytes]) -> List[str]:
+    # единая точка для пакетного хэширования (под multi-buffer бэкенд); сейчас — цикл по OpenSSL
+    h = _SHA256
+    return [h(b).hexdigest() for b in items]
+
+
+def sha256_hex(s: str | bytes) -> str:
+    if isinstance(s, str):
+        s = s.encode("utf-8")
+    return sha256_hex_bytes(s)
 
 
 def estimate_tokens(text: str) -> int:
@@ -26,6 +64,17 @@ def estimate_tokens(text: str) -> int:
     return max(1, len(text) // 4)
 
 
+def _chunk_spans(n: int, chunk_size: int, overlap: int) -> List[tuple[int, int]]:
+    # скользящее окно с шагом stride: ceil((n - size) / stride) + 1 окон, границы считаются арифметикой
+    if n <= 0:
+        return []
+    if n <= chunk_size:
+        return [(0, n)]
+    stride = chunk_size - overlap
+    count = -(-(n - chunk_size) // stride) + 1
+    return [(i, min(n, i + chunk_size)) for i in range(0, min(n, count * stride), stride)]
+
+
 def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
     text = normalize_text(text)
     if chunk_size <= 0:
@@ -34,43 +83,52 @@ def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
         overlap = chunk_size // 4
 
     chunks: List[str] = []
-    i = 0
-    n = len(text)
-    while i < n:
-        j = min(n, i + chunk_size)
-        chunk = text[i:j].strip()
-        if chunk:
-            chunks.append(chunk)
-        if j == n:
-            break
-        i = max(0, j - overlap)
+    for i, j in _chunk_spans(len(text), chunk_size, overlap):
+        # сдвигаем границы окна за пробельные символы (как str.strip) и режем строку один раз
+        while i < j and text[i].isspace():
+            i += 1
+        while j > i and text[j - 1].isspace():
+            j -= 1
+        if i < j:
+            chunks.append(text[i:j])
     return chunks
 
 
 def compact_quote(text: str, max_len: int = 320) -> str:
-    t = normalize_text(text)
+    # на символ больше лимита — чтобы отличить "ровно max_len" от "длиннее"
+    t = normalize_text(text, max_len=max_len + 1)
     if len(t) <= max_len:
         return t
     return t[: max_len - 1].rstrip() + "…"
 
 
+# фиксированная точка для токенов: 1 токен = 10^6 единиц, дробная стоимость без FP-дрейфа
+_TOKEN_SCALE = 1_000_000
+_NS_PER_MINUTE = 60_000_000_000
+
+
 @dataclass
 class RateLimiter:
     per_minute: int
-    _tokens: float = 0.0
-    _last: float = 0.0
+    _tokens: int = 0
+    _last_ns: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
 
     def __post_init__(self) -> None:
-        self._tokens = float(self.per_minute)
-        self._last = time.time()
+        self._tokens = self.per_minute * _TOKEN_SCALE
+        # monotonic: wall clock может прыгнуть назад (NTP) и дать отрицательный elapsed
+        self._last_ns = time.monotonic_ns()
 
     def allow(self, cost: float = 1.0) -> bool:
-        now = time.time()
-        elapsed = now - self._last
-        self._last = now
-        refill = elapsed * (self.per_minute / 60.0)
-        self._tokens = min(float(self.per_minute), self._tokens + refill)
-        if self._tokens >= cost:
-            self._tokens -= cost
-            return True
-        return False
+        need = int(cost * _TOKEN_SCALE)
+        capacity = self.per_minute * _TOKEN_SCALE
+        with self._lock:
+            now = time.monotonic_ns()
+            elapsed = now - self._last_ns
+            self._last_ns = now
+            refill = elapsed * self.per_minute * _TOKEN_SCALE // _NS_PER_MINUTE
+            self._tokens = min(capacity, self._tokens + refill)
+            if self._tokens >= need:
+                self._tokens -= need
+                return True
+            return False
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import unittest
+from unittest.mock import patch
+
+from shared.cache import SemanticCache
+
+
+class SemanticCacheTests(unittest.TestCase):
+    def test_hit_above_threshold_and_tag_isolation(self):
+        cache = SemanticCache(maxsize=4, ttl_s=60, threshold=0.95)
+        cache.put([1.0, 0.0, 0.0], {"answer": "a"}, tag=("consult", 6))
+
+        self.assertEqual(cache.get([0.99, 0.05, 0.0], tag=("consult", 6)), {"answer": "a"})
+        self.assertIsNone(cache.get([0.0, 1.0, 0.0], tag=("consult", 6)))
+        self.assertIsNone(cache.get([1.0, 0.0, 0.0], tag=("brief", 6)))
+        self.assertIsNone(cache.get([1.0, 0.0], tag=("consult", 6)))
+
+    def test_evicts_least_recently_used(self):
+        cache = SemanticCache(maxsize=2, ttl_s=60, threshold=0.95)
+        cache.put([1.0, 0.0, 0.0], "x")
+        cache.put([0.0, 1.0, 0.0], "y")
+        self.assertEqual(cache.get([1.0, 0.0, 0.0]), "x")
+
+        cache.put([0.0, 0.0, 1.0], "z")
+
+        self.assertEqual(cache.get([1.0, 0.0, 0.0]), "x")
+        self.assertIsNone(cache.get([0.0, 1.0, 0.0]))
+        self.assertEqual(cache.get([0.0, 0.0, 1.0]), "z")
+
+    def test_expired_entries_miss_and_free_their_slot(self):
+        cache = SemanticCache(maxsize=1, ttl_s=10, threshold=0.95)
+        with patch("shared.cache.time.monotonic", return_value=100.0):
+            cache.put([1.0, 0.0], "old")
+        with patch("shared.cache.time.monotonic", return_value=111.0):
+            self.assertIsNone(cache.get([1.0, 0.0]))
+            cache.put([0.0, 1.0], "new")
+            self.assertEqual(cache.get([0.0, 1.0]), "new")
+
+
+if __name__ == "__main__":
+    unittest.main()
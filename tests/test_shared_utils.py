@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import hashlib
+import random
+import re
+import unittest
+from unittest.mock import patch
+
+from shared.utils import (
+    RateLimiter,
+    _chunk_spans,
+    chunk_text,
+    compact_quote,
+    normalize_text,
+    sha256_hex,
+    sha256_hex_bytes,
+    sha256_many,
+)
+
+
+def _normalize_text_reference(s: str) -> str:
+    s = s.replace("\r\n", "\n").replace("\r", "\n")
+    s = re.sub(r"[ \t\u00A0]+", " ", s)
+    s = re.sub(r"\n{3,}", "\n\n", s)
+    return s.strip()
+
+
+def _chunk_spans_reference(n: int, chunk_size: int, overlap: int) -> list[tuple[int, int]]:
+    spans = []
+    i = 0
+    while i < n:
+        j = min(n, i + chunk_size)
+        spans.append((i, j))
+        if j == n:
+            break
+        i = max(0, j - overlap)
+    return spans
+
+
+class SharedUtilsTests(unittest.TestCase):
+    def test_sha256_hex_accepts_str_and_bytes(self):
+        expected = hashlib.sha256("Стаття 1".encode("utf-8")).hexdigest()
+        self.assertEqual(sha256_hex("Стаття 1"), expected)
+        self.assertEqual(sha256_hex("Стаття 1".encode("utf-8")), expected)
+        self.assertEqual(sha256_hex_bytes("Стаття 1".encode("utf-8")), expected)
+
+    def test_sha256_many_matches_single_hashes(self):
+        items = [b"", b"a", "Стаття 2".encode("utf-8")]
+        self.assertEqual(sha256_many(items), [sha256_hex_bytes(b) for b in items])
+
+    def test_sha256_hex_bytes_small_and_large_inputs(self):
+        small = "Преамбула".encode("utf-8")
+        large = b"x" * 10_000
+        self.assertEqual(sha256_hex_bytes(small), hashlib.sha256(small).hexdigest())
+        self.assertEqual(sha256_hex_bytes(bytearray(small)), hashlib.sha256(small).hexdigest())
+        self.assertEqual(sha256_hex_bytes(large), hashlib.sha256(large).hexdigest())
+
+    def test_normalize_text_matches_reference(self):
+        rnd = random.Random(42)
+        alphabet = ["a", "б", " ", "  ", "\t", "\u00a0", "\n", "\r", "\r\n", ".", "\n\n\n"]
+        samples = ["", "  Стаття 1.\r\n\r\n\r\nТекст\t \u00a0норми  ", "a\r\rb", "x \n \n \n y"]
+        samples += ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 60))) for _ in range(500)]
+        for s in samples:
+            self.assertEqual(normalize_text(s), _normalize_text_reference(s), repr(s))
+
+    def test_normalize_text_max_len_and_compact_quote_match_full_normalization(self):
+        rnd = random.Random(7)
+        alphabet = ["a", "б", " ", "      ", "\t", "\u00a0", "\n", "\r\n", "\n\n\n\n", "."]
+        for _ in range(500):
+            s = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 200)))
+            full = _normalize_text_reference(s)
+            for max_len in (0, 1, 5, 17, 40):
+                self.assertEqual(normalize_text(s, max_len=max_len), full[:max_len], repr(s))
+                expected = full if len(full) <= max_len else full[: max_len - 1].rstrip() + "…"
+                if max_len:
+                    self.assertEqual(compact_quote(s, max_len=max_len), expected, repr(s))
+
+    def test_chunk_spans_match_sliding_window(self):
+        for n in range(0, 60):
+            for size, overlap in ((10, 0), (10, 3), (10, 9), (7, -2), (1, 0)):
+                self.assertEqual(_chunk_spans(n, size, overlap), _chunk_spans_reference(n, size, overlap), (n, size, overlap))
+
+    def test_chunk_text_trims_window_edges(self):
+        text = normalize_text("Стаття 1. Текст \n\n норми   про працю.\n\nСтаття 2. Інше " * 20)
+        expected = [text[i:j].strip() for i, j in _chunk_spans_reference(len(text), 50, 10)]
+        self.assertEqual(chunk_text(text, 50, 10), [c for c in expected if c])
+
+    def test_rate_limiter_refills_on_monotonic_clock(self):
+        clock = [10_000_000_000]
+        with patch("shared.utils.time.monotonic_ns", side_effect=lambda: clock[0]):
+            limiter = RateLimiter(per_minute=2)
+            self.assertTrue(limiter.allow())
+            self.assertTrue(limiter.allow())
+            self.assertFalse(limiter.allow())
+
+            clock[0] += 30_000_000_000  # +30 s -> +1 token
+            self.assertTrue(limiter.allow())
+            self.assertFalse(limiter.allow(0.5))
+
+            clock[0] += 15_000_000_000  # +15 s -> +0.5 token
+            self.assertTrue(limiter.allow(0.5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from celery import Celery
 
+from shared.celery_common import TASK_ROUTES, serialization_conf
 from shared.settings import get_settings
 
 settings = get_settings()
@@ -14,11 +15,11 @@ celery_app = Celery(
 )
 
 celery_app.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
+    **serialization_conf(),
+    task_routes=TASK_ROUTES,
     timezone="UTC",
     enable_utc=True,
     task_track_started=True,
+    # действует только на prefork (`worker`); у threads-пула `worker-llm` дочерних процессов нет
     worker_max_tasks_per_child=200,
 )
@@ -1,25 +1,60 @@
 from __future__ import annotations
 
-import hashlib
+import functools
 import re
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, TypedDict
 from uuid import UUID
 
+import numpy as np
 from celery import shared_task
 from sqlalchemy import select
 
-from shared.db import get_session, init_db
+try:
+    import xxhash
+except Exception:  # pragma: no cover
+    xxhash = None
+
+from shared.cache import RedisAnswerCache, SemanticCache
+from shared.db import get_ro_session, get_session, init_db
 from shared.ingest import ingest_url
 from shared.llm import answer_with_citations
 from shared.models import Message
-from shared.retrieval import retrieve
-from shared.schemas import Citation
+from shared.retrieval import embed_query, retrieve
 from shared.settings import get_settings
+from shared.utils import sha256_many
 
-settings = get_settings()
 _CIT_RE = re.compile(r"\[(\d{1,2})\]")
 _NEED_MORE_RE = re.compile(r"(?im)^\s*need_more_info\s*=\s*(true|false)\s*$")
 
+# заголовок блока контекста; текст фрагмента дописывается после него (уже обрезанным под бюджет)
+_CTX_HEADER_TMPL = "[{i}] {title}{loc_line}\nURL: {url}\nФрагмент:\n"
+
+_answer_cache = SemanticCache(
+    maxsize=get_settings().semantic_cache_size,
+    ttl_s=get_settings().semantic_cache_ttl_s,
+    threshold=get_settings().semantic_cache_threshold,
+)
+_exact_answer_cache = RedisAnswerCache(get_settings().redis_url, ttl_s=get_settings().answer_cache_ttl_s)
+
+
+# UUID отдаются как есть: orjson (и kombu json) сериализуют их сами, str() на стороне задачи не нужен
+class IngestTaskResult(TypedDict):
+    source_id: UUID
+    document_id: UUID
+    chunks_upserted: int
+    changed: bool
+
+
+class IngestItemResult(TypedDict, total=False):
+    url: str
+    source_id: UUID
+    document_id: UUID
+    chunks_upserted: int
+    changed: bool
+    error: str
+
 
 @shared_task(name="worker.tasks.init_db")
 def init_db_task() -> dict[str, Any]:
@@ -28,39 +63,28 @@ def init_db_task() -> dict[str, Any]:
 
 
 @shared_task(name="worker.tasks.ingest_source")
-def ingest_source(url: str, title: str | None = None, meta: dict[str, Any] | None = None) -> dict[str, Any]:
+def ingest_source(url: str, title: str | None = None, meta: dict[str, Any] | None = None) -> IngestTaskResult:
     with get_session() as session:
         r = ingest_url(session, url=url, title=title, meta=meta or {})
-        return {
-            "source_id": str(r.source_id),
-            "document_id": str(r.document_id),
-            "chunks_upserted": r.chunks_upserted,
-            "changed": r.changed,
-        }
+
+    # после коммита: ответы, посчитанные по прежнему корпусу, больше не отдаются
+    if r.changed:
+        _exact_answer_cache.invalidate()
+    return {
+        "source_id": r.source_id,
+        "document_id": r.document_id,
+        "chunks_upserted": r.chunks_upserted,
+        "changed": r.changed,
+    }
 
 
 @shared_task(name="worker.tasks.ingest_batch_sources")
 def ingest_batch_sources(urls: list[str], title: str | None = None, meta: dict[str, Any] | None = None) -> dict[str, Any]:
     clean_urls = [str(u).strip() for u in (urls or []) if str(u).strip().startswith("http")]
 
-    out_results: list[dict[str, Any]] = []
-    out_errors: list[dict[str, str]] = []
-
-    with get_session() as session:
-        for url in clean_urls:
-            try:
-                r = ingest_url(session, url=url, title=title, meta=meta or {})
-                out_results.append(
-                    {
-                        "url": url,
-                        "source_id": str(r.source_id),
-                        "document_id": str(r.document_id),
-                        "chunks_upserted": int(r.chunks_upserted),
-                        "changed": bool(r.changed),
-                    }
-                )
-            except Exception as exc:
-                out_errors.append({"url": url, "error": str(exc)})
+    out = _ingest_items([{"url": url, "title": title, "meta": meta} for url in clean_urls])
+    out_results = [o for o in out if "error" not in o]
+    out_errors = [{"url": o["url"], "error": o["error"]} for o in out if "error" in o]
 
     return {
         "total": len(clean_urls),
@@ -71,6 +95,45 @@ def ingest_batch_sources(urls: list[str], title: str | None = None, meta: dict[s
     }
 
 
+@shared_task(name="worker.tasks.ingest_sources_bulk")
+def ingest_sources_bulk(items: list[dict[str, Any]]) -> list[IngestItemResult]:
+    # пачка {"url", "title"?, "meta"?} за одно сообщение брокера и одну сессию; ошибки — по элементу
+    return _ingest_items(items or [])
+
+
+def _ingest_items(items: list[dict[str, Any]]) -> list[IngestItemResult]:
+    out: list[IngestItemResult] = []
+
+    with get_session() as session:
+        for item in items:
+            url = str(item.get("url") or "").strip()
+            if not url.startswith("http"):
+                out.append({"url": url, "error": "invalid url"})
+                continue
+            try:
+                # SAVEPOINT на элемент: ошибка БД откатывает только его, а не всю транзакцию пачки
+                with session.begin_nested():
+                    r = ingest_url(session, url=url, title=item.get("title"), meta=item.get("meta") or {})
+            except Exception as exc:
+                out.append({"url": url, "error": str(exc)})
+                continue
+            out.append(
+                {
+                    "url": url,
+                    "source_id": r.source_id,
+                    "document_id": r.document_id,
+                    "chunks_upserted": r.chunks_upserted,
+                    "changed": r.changed,
+                }
+            )
+
+    if any(o.get("changed") for o in out):
+        _exact_answer_cache.invalidate()
+    return out
+
+
+# чанки одного документа повторяют одни и те же пары path/heading; кэш ограничен для долгоживущих воркеров
+@functools.lru_cache(maxsize=4096)
 def _fmt_loc(path: str | None, heading: str | None) -> str:
     a = (heading or "").strip()
     b = (path or "").strip()
@@ -79,52 +142,72 @@ def _fmt_loc(path: str | None, heading: str | None) -> str:
     return a or b
 
 
-def _normalize_usage(raw: Any) -> dict[str, Any]:
-    if raw is None:
-        return {}
-    if hasattr(raw, "model_dump"):
-        try:
-            dumped = raw.model_dump(mode="json")
-            if isinstance(dumped, dict):
-                return dumped
-        except Exception:
-            pass
-    if hasattr(raw, "dict"):
-        try:
-            dumped = raw.dict()
-            if isinstance(dumped, dict):
-                return dumped
-        except Exception:
-            pass
-    if isinstance(raw, dict):
-        return raw
+# способ выгрузки usage выбирается один раз на тип (pydantic v2 / v1 / dict), а не hasattr на каждый ответ
+def _dump_model_json(raw: Any) -> Any:
+    return raw.model_dump(mode="json")
+
+
+def _dump_dict(raw: Any) -> Any:
+    return raw.dict()
+
+
+def _identity(raw: Any) -> Any:
+    return raw
+
+
+def _empty(raw: Any) -> Any:
     return {}
 
 
-def _history_for_chat(session, chat_id: str, limit: int = 16) -> list[dict[str, str]]:
+_USAGE_DUMPERS: dict[type, Callable[[Any], Any]] = {}
+
+
+def _usage_dumper(cls: type) -> Callable[[Any], Any]:
+    fn = _USAGE_DUMPERS.get(cls)
+    if fn is None:
+        if hasattr(cls, "model_dump"):
+            fn = _dump_model_json
+        elif hasattr(cls, "dict"):
+            fn = _dump_dict
+        elif issubclass(cls, dict):
+            fn = _identity
+        else:
+            fn = _empty
+        _USAGE_DUMPERS[cls] = fn
+    return fn
+
+
+def _normalize_usage(raw: Any) -> dict[str, Any]:
+    if raw is None:
+        return {}
     try:
-        chat_uuid = UUID(str(chat_id))
+        dumped = _usage_dumper(type(raw))(raw)
     except Exception:
+        return {}
+    return dumped if isinstance(dumped, dict) else {}
+
+
+def _history_for_chat(session, chat_uuid: UUID | None, limit: int = 16) -> list[dict[str, str]]:
+    if chat_uuid is None:
         return []
 
-    rows = session.execute(
-        select(Message.role, Message.content)
+    # последние `limit` сообщений (обратный проход по ix_messages_chat_created), затем
+    # хронологический порядок уже в БД — без reversed() на стороне Python
+    last = (
+        select(Message.role, Message.content, Message.created_at)
         .where(Message.chat_id == chat_uuid)
         .order_by(Message.created_at.desc())
         .limit(limit)
-    ).all()
+        .subquery()
+    )
+    rows = session.execute(select(last.c.role, last.c.content).order_by(last.c.created_at.asc())).all()
 
-    history = [{"role": str(role), "content": str(content)} for role, content in reversed(rows)]
-    return history
+    return [{"role": str(role), "content": str(content)} for role, content in rows]
 
 
 def _extract_used_numbers(answer: str) -> list[int]:
-    nums: list[int] = []
-    for s in _CIT_RE.findall(answer or ""):
-        n = int(s)
-        if n not in nums:
-            nums.append(n)
-    return nums
+    # dict.fromkeys — O(n) с сохранением порядка; `n not in list` было квадратичным на "[1][1][1]..."
+    return list(dict.fromkeys(int(s) for s in _CIT_RE.findall(answer or "")))
 
 
 def _filter_citations(citations: list[dict[str, Any]], used: list[int]) -> list[dict[str, Any]]:
@@ -134,7 +217,11 @@ def _filter_citations(citations: list[dict[str, Any]], used: list[int]) -> list[
     return [c for c in citations if int(c.get("n", 0)) in used_set]
 
 
-def _dedup_key(hit: Any) -> tuple[str, str]:
+# (вид, значение): для "text" значение после _deduplicate_hits — дайджест (int от xxh3 или hex sha256)
+_DedupKey = tuple[str, str | int]
+
+
+def _dedup_key(hit: Any) -> _DedupKey:
     doc_id = str(getattr(hit, "document_id", "") or "")
     chunk_id = str(getattr(hit, "chunk_id", "") or "")
     if doc_id and chunk_id:
@@ -145,35 +232,82 @@ def _dedup_key(hit: Any) -> tuple[str, str]:
     if url or loc:
         return ("url_loc", f"{url}|{loc}")
 
+    # сам текст; хэш для text-ключей считается пачкой в _deduplicate_hits
     text = (str(getattr(hit, "text", "") or "")).strip().lower()
-    return ("text", hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest())
+    return ("text", text)
 
 
-def _deduplicate_hits(hits: list[Any]) -> list[Any]:
-    best_by_key: dict[tuple[str, str], Any] = {}
-    order: list[tuple[str, str]] = []
+def _text_digests(items: list[bytes]) -> list[str | int]:
+    # ключу дедупликации криптостойкость не нужна: 64-битный int вместо 64-символьной hex-строки
+    if xxhash is not None:
+        h = xxhash.xxh3_64_intdigest
+        return [h(b) for b in items]
+    return sha256_many(items)
+
 
-    for h in hits or []:
-        key = _dedup_key(h)
-        if key not in best_by_key:
-            best_by_key[key] = h
-            order.append(key)
-            continue
+# начиная с этого размера выбор лучшего хита в группе делается в numpy; для k <= 10 dict-цикл быстрее
+_DEDUP_VECTOR_MIN = 32
 
-        prev = best_by_key[key]
-        prev_score = float(getattr(prev, "score", 0.0) or 0.0)
-        new_score = float(getattr(h, "score", 0.0) or 0.0)
-        if new_score > prev_score:
-            best_by_key[key] = h
 
-    return [best_by_key[k] for k in order]
+def _best_per_key_np(hits: list[Any], keys: list[_DedupKey]) -> list[Any]:
+    # группа = номер ключа в порядке первого появления; сортировка (группа, -score, позиция)
+    # ставит лучший хит первым в группе, при равных score — более ранний, как в dict-цикле
+    group_ids: dict[_DedupKey, int] = {}
+    n = len(hits)
+    groups = np.fromiter((group_ids.setdefault(k, len(group_ids)) for k in keys), dtype=np.intp, count=n)
+    scores = np.fromiter((float(getattr(h, "score", 0.0) or 0.0) for h in hits), dtype=np.float64, count=n)
+
+    order = np.lexsort((np.arange(n), -scores, groups))
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_groups[1:] != sorted_groups[:-1])))
+    return [hits[i] for i in order[starts].tolist()]
+
+
+def _deduplicate_hits(hits: list[Any]) -> list[Any]:
+    hits = list(hits or [])
+    keys: list[_DedupKey] = [_dedup_key(h) for h in hits]
+
+    text_idx = [i for i, (kind, _) in enumerate(keys) if kind == "text"]
+    if text_idx:
+        digests = _text_digests([keys[i][1].encode("utf-8", errors="ignore") for i in text_idx])
+        for i, digest in zip(text_idx, digests):
+            keys[i] = ("text", digest)
+
+    if len(hits) >= _DEDUP_VECTOR_MIN:
+        return _best_per_key_np(hits, keys)
+
+    # score читается один раз на хит и хранится рядом с лучшим хитом группы;
+    # dict сохраняет порядок вставки — отдельный список order не нужен
+    best_by_key: dict[_DedupKey, tuple[float, Any]] = {}
+    for h, key in zip(hits, keys):
+        score = float(getattr(h, "score", 0.0) or 0.0)
+        prev = best_by_key.get(key)
+        if prev is None or score > prev[0]:
+            best_by_key[key] = (score, h)
+
+    return [h for _score, h in best_by_key.values()]
+
+
+@contextmanager
+def _embed_pool():
+    # выход не ждёт фоновый эмбеддинг: ожидающий single-flight возвращает ответ лидера сразу,
+    # а не после своего (уже ненужного) запроса к OpenAI
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        yield pool
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
 
 
 def _clean_service_markers(text: str) -> str:
-    return re.sub(_NEED_MORE_RE, "", text or "").strip()
+    return _NEED_MORE_RE.sub("", text or "").strip()
 
 
-@shared_task(name="worker.tasks.answer_question")
+# Celery-лимиты времени на threads-пуле (worker-llm) не работают; зависший вызов LLM ограничивает
+# таймаут запроса в answer_with_citations (ANSWER_TIMEOUT_S), после чего ответ собирается из фрагментов.
+# acks_late — сообщение подтверждается после выполнения, при тёплом рестарте воркера задача не теряется.
+# Автоповторов и reject_on_worker_lost нет: API ждёт результат 70 с, повтор пришёл бы уже никому.
+@shared_task(name="worker.tasks.answer_question", acks_late=True)
 def answer_question(
     user_external_id: int | None,
     chat_id: str,
@@ -185,9 +319,51 @@ def answer_question(
     max_citations = max(1, min(int(max_citations), 10))
     mode = mode if mode in {"brief", "consult"} else "consult"
 
-    with get_session() as session:
-        history = _history_for_chat(session, chat_id=chat_id, limit=16)
-        hits = retrieve(session, question, k=max_citations)
+    # chat_id приходит строкой из JSON-payload; парсим один раз и дальше держим UUID
+    try:
+        chat_uuid: UUID | None = UUID(str(chat_id))
+    except ValueError:
+        chat_uuid = None
+
+    # кэши ответов — только для первого вопроса в чате, где ответ не зависит от истории
+    cache_tag = (mode, max_citations, round(float(temperature), 2))
+    exact_cached, cache_version = _exact_answer_cache.get(question, tag=cache_tag)
+    # in-process кэш сбрасывать некому: версия корпуса входит в его tag, и после ingest записи
+    # прошлой версии не совпадают. Версия неизвестна (ANSWER_CACHE_TTL_S=0 или Redis недоступен) —
+    # семантический кэш не трогаем
+    semantic_tag = (*cache_tag, cache_version) if cache_version >= 0 else None
+
+    # single-flight: одновременные одинаковые первые вопросы считает один воркер
+    with _exact_answer_cache.single_flight(question, tag=cache_tag) as flight:
+        with get_ro_session() as session, _embed_pool() as pool:
+            # эмбеддинг вопроса (запрос к OpenAI) идёт параллельно с загрузкой истории из БД;
+            # при попадании в точный кэш он, скорее всего, не понадобится — не запускаем заранее
+            qvec_future = pool.submit(embed_query, question) if exact_cached is None else None
+            history = _history_for_chat(session, chat_uuid, limit=16)
+            first_turn = not any(h.get("role") == "assistant" for h in history)
+
+            if exact_cached is not None:
+                if first_turn:
+                    return exact_cached
+                qvec_future = pool.submit(embed_query, question)
+            elif first_turn and not flight.claim():
+                # тот же вопрос уже считает другой воркер: ждём его ответ вместо второго вызова LLM.
+                # Соединение на время ожидания возвращаем в пул (сессия переоткроет его при необходимости)
+                session.close()
+                shared = flight.wait()
+                if shared is not None:
+                    return shared
+            qvec = qvec_future.result()
+
+            if first_turn and qvec is not None and semantic_tag is not None:
+                cached = _answer_cache.get(qvec, tag=semantic_tag)
+                if cached is not None:
+                    flight.publish(cached)
+                    return cached
+
+            hits = retrieve(session, question, k=max_citations, qvec=qvec, embed=False)
+
+        # дальше БД не нужна: соединение возвращается в пул до вызова LLM, а не держится секунды ответа
         hits = _deduplicate_hits(hits)
 
         if not hits:
@@ -209,41 +385,64 @@ def answer_question(
         citations_hint_lines: List[str] = []
         citations: List[Dict[str, Any]] = []
 
+        # ограничение на общий контекст: бюджет (с разделителем "\n\n" между блоками) делится по хитам
+        # заранее — текст фрагмента режется до склейки, лишние мегабайты не копируются.
+        # Когда бюджет исчерпан, блоки контекста больше не собираем (цитаты — собираем)
+        remaining = get_settings().max_context_chars
+
         for i, h in enumerate(hits, start=1):
             loc = _fmt_loc(h.path, h.heading)
             loc_line = f"\nЛокація: {loc}" if loc else ""
+            loc_suffix = f" ({loc})" if loc else ""
 
-            context_blocks.append(
-                f"[{i}] {h.title or 'Документ'}{loc_line}\nURL: {h.url or ''}\nФрагмент:\n{h.text}"
-            )
-            citations_hint_lines.append(f"[{i}] = {h.url or h.title or 'source'}" + (f" ({loc})" if loc else ""))
-
+            if remaining > 0:
+                header = _CTX_HEADER_TMPL.format_map(
+                    {"i": i, "title": h.title or "Документ", "loc_line": loc_line, "url": h.url or ""}
+                )
+                room = remaining - (2 if context_blocks else 0) - len(header)
+                text = h.text
+                truncated = len(text) > room
+                if truncated:
+                    # "\n…" помечает обрезку и укладывается в тот же бюджет; при room < 3 нет места
+                    # даже на один символ текста с маркером
+                    text = text[: room - 2].rstrip() if room >= 3 else ""
+                if room <= 0 or (truncated and not text):
+                    # блок без текста (один заголовок) не добавляем — бюджет исчерпан
+                    remaining = 0
+                elif truncated:
+                    # блок склеивается одним join, без промежуточной копии обрезанного текста
+                    context_blocks.append("".join((header, text, "\n…")))
+                    remaining = room - len(text) - 2
+                else:
+                    context_blocks.append(header + text)
+                    remaining = room - len(text)
+
+            citations_hint_lines.append(f"[{i}] = {h.url or h.title or 'source'}{loc_suffix}")
+
+            q = h.text[:321]
+            # готовый JSON-совместимый dict той же формы, что Citation.model_dump(mode="json"),
+            # без валидации/сериализации pydantic на каждый хит; схема Citation остаётся для API
             citations.append(
-                Citation(
-                    n=i,
-                    document_id=h.document_id,
-                    chunk_id=h.chunk_id,
-                    title=h.title,
-                    url=h.url,
-                    path=h.path,
-                    heading=h.heading,
-                    unit_type=h.unit_type,
-                    unit_id=h.unit_id,
-                    quote=h.text[:320] + ("…" if len(h.text) > 320 else ""),
-                    score=float(h.score),
-                ).model_dump(mode="json")
+                {
+                    "n": i,
+                    "document_id": str(h.document_id),
+                    "chunk_id": str(h.chunk_id),
+                    "title": h.title,
+                    "url": h.url,
+                    "path": h.path,
+                    "heading": h.heading,
+                    "unit_type": h.unit_type,
+                    "unit_id": h.unit_id,
+                    "quote": q[:320] + "…" if len(q) == 321 else q,
+                    "score": float(h.score),
+                }
             )
 
-        # ограничение на общий контекст
-        joined = "\n\n".join(context_blocks)
-        if len(joined) > settings.max_context_chars:
-            joined = joined[: settings.max_context_chars].rstrip() + "\n…"
-            context_blocks = [joined]
-
         citations_hint = "\n".join(citations_hint_lines)
 
         llm_out: dict[str, Any] = {}
         answer_text = ""
+        llm_ok = False
         used_numbers: list[int] = []
 
         try:
@@ -256,6 +455,7 @@ def answer_question(
                 temperature=temperature,
             )
             answer_text = (llm_out.get("answer_markdown") or "").strip()
+            llm_ok = bool(answer_text)
             used_numbers = [int(x) for x in llm_out.get("citations_used", []) if str(x).isdigit()]
         except Exception:
             answer_text = ""
@@ -274,7 +474,7 @@ def answer_question(
 
         filtered = _filter_citations(citations, used_numbers)
 
-        return {
+        result = {
             "answer": answer_text,
             "citations": filtered,
             "need_more_info": bool(llm_out.get("need_more_info", False)) if llm_out else False,
@@ -282,3 +482,9 @@ def answer_question(
             "notes": [str(n).strip() for n in (llm_out.get("notes") or []) if str(n).strip()] if llm_out else [],
             "usage": _normalize_usage(llm_out.get("usage") if llm_out else {}),
         }
+        if first_turn and llm_ok:
+            _exact_answer_cache.put(question, result, tag=cache_tag, version=cache_version)
+            if qvec is not None and semantic_tag is not None:
+                _answer_cache.put(qvec, result, tag=semantic_tag)
+            flight.publish(result)
+        return result